@@ -1,4 +1,6 @@
-from moviepy.editor import ImageClip, AudioFileClip, CompositeVideoClip, concatenate_videoclips, VideoFileClip
+from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips, VideoFileClip
+from moviepy.config import get_setting
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, Dict, Any
 from docx.oxml.ns import qn
 from docx.shared import Pt
@@ -6,15 +8,56 @@ from docx import Document
 from io import BytesIO
 from PIL import Image
 
-import requests, json, os, re
+import json, os, re, hashlib, subprocess, tempfile
 from knowledge_prompt_cn import parser_system_prompt, generate_image_system_prompt, content
-from genai_api import text_to_text, text_to_image, text_to_audio
+from genai_api import text_to_text, text_to_image, text_to_audio, http_session, HTTP_TIMEOUT
+
+################ LLM Response Cache ################
+# LLM 原始输出缓存在磁盘上，相同输入重复运行时跳过 API 调用
+LLM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "AIGC_Video", "llm")
+
+def _llm_cache_key(*parts: Any) -> str:
+    return hashlib.blake2b("|".join(map(str, parts)).encode("utf-8"), digest_size=16).hexdigest()
+
+def _llm_cache_path(key: str) -> str:
+    return os.path.join(LLM_CACHE_DIR, key[:2], f"{key}.json")
+
+def _llm_cache_get(key: str) -> Optional[Any]:
+    try:
+        with open(_llm_cache_path(key), 'r', encoding='utf-8') as f:
+            return json.load(f)["output"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _llm_cache_put(key: str, output: Any) -> None:
+    path = _llm_cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so a crash never leaves a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"output": output}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"写入 LLM 缓存失败: {e}")
+
+def _llm_cache_evict(key: str) -> None:
+    try:
+        os.remove(_llm_cache_path(key))
+    except FileNotFoundError:
+        pass
 
 ################ Content Parser ################
-def content_parser(server: str, model: str, content: str, num_plots: int) -> Optional[Dict[str, Any]]:
+def content_parser(server: str, model: str, content: str, num_plots: int, refresh: bool = False) -> Optional[Dict[str, Any]]:
     try:
-        user_message = f"Parse this content into {num_plots} plots. The content is as following:\n\n{content}"
-        output = text_to_text(server=server, model=model, prompt=user_message, system_message=parser_system_prompt, max_tokens=4096, temperature=0.7)
+        max_tokens, temperature = 4096, 0.7
+        # refresh=True skips the cached parse and overwrites it with a fresh one
+        cache_key = _llm_cache_key(server, model, parser_system_prompt, max_tokens, temperature, num_plots, content)
+        output = None if refresh else _llm_cache_get(cache_key)
+        from_cache = output is not None
+        if not from_cache:
+            user_message = f"Parse this content into {num_plots} plots. The content is as following:\n\n{content}"
+            output = text_to_text(server=server, model=model, prompt=user_message, system_message=parser_system_prompt, max_tokens=max_tokens, temperature=temperature)
         if output is None:
             raise ValueError("未能从 API 获取响应。")
         
@@ -30,6 +73,9 @@ def content_parser(server: str, model: str, content: str, num_plots: int) -> Opt
             missing_keys = [key for key in required_keys if key not in parsed_content]
             raise ValueError(f"生成的 JSON 缺少必需的 Key: {', '.join(missing_keys)}")
         
+        # Only cache fresh outputs that parsed cleanly so a bad response is retried
+        if not from_cache:
+            _llm_cache_put(cache_key, output)
         return parsed_content
     
     except json.JSONDecodeError:
@@ -132,17 +178,31 @@ def parsed_saver(parsed_json: Dict[str, Any], saving_path: str = None) -> None:
     print(f"文件保存到：{doc_path}")
 
 ################ Image Generation ################
-def generate_image_prompt(server, model, prompt, regenerate=False):
+# 并发生成图片的线程数上限，避免触发图片 API 的速率限制
+MAX_IMAGE_WORKERS = 4
+
+def generate_image_prompt(server, model, prompt, regenerate=False, refresh=False):
     
     # Define system message for image prompt generation
     system_message = generate_image_system_prompt
     if regenerate:
         system_message += "\n\nCreate a safe, non-controversial prompt that captures the essence of the scene."
     
+    # Keyed on the base system prompt so a regenerated prompt replaces the rejected one;
+    # regenerate and refresh always go to the LLM
+    cache_key = _llm_cache_key(server, model, generate_image_system_prompt, prompt)
+    cached = None if regenerate or refresh else _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    
     response = text_to_text(server = server, model = model, prompt = prompt, system_message = system_message, max_tokens=4096, temperature=0.7)
+    if response:
+        _llm_cache_put(cache_key, response)
+    elif regenerate:
+        _llm_cache_evict(cache_key)
     return response
 
-def generate_images(image_server, image_model, llm_server, llm_model, parsed_content, plot_index, size, num_images=1, saving_path=None):
+def generate_images(image_server, image_model, llm_server, llm_model, parsed_content, plot_index, size, num_images=1, saving_path=None, refresh_llm_cache=False):
     
     if saving_path is None:
         saving_path = os.path.join(os.path.expanduser('~'), 'Desktop')
@@ -158,7 +218,7 @@ def generate_images(image_server, image_model, llm_server, llm_model, parsed_con
         plot = parsed_content["segmentations"][plot_index - 1]
         input_for_prompt = f"Generate images according to the following information: \n{plot}"
 
-    image_prompt = generate_image_prompt(server=llm_server, model=llm_model, prompt=input_for_prompt, regenerate=False)
+    image_prompt = generate_image_prompt(server=llm_server, model=llm_model, prompt=input_for_prompt, regenerate=False, refresh=refresh_llm_cache)
 
     images = []
     # Generate images
@@ -166,7 +226,7 @@ def generate_images(image_server, image_model, llm_server, llm_model, parsed_con
         for attempt in range(5):
             try:
                 image_url = text_to_image(server=image_server, model=image_model, prompt=image_prompt, size=size)
-                image = Image.open(BytesIO(requests.get(image_url).content))
+                image = Image.open(BytesIO(http_session.get(image_url, timeout=HTTP_TIMEOUT).content))
                 images.append(image)
                 print(f"用模型 {image_model} 为第 {plot_index} 幕生成第 {i+1} 张图片 .")
                 break
@@ -189,14 +249,30 @@ def generate_images(image_server, image_model, llm_server, llm_model, parsed_con
     print(f"为第 {plot_index} 幕保存第 {len(image_paths)} 张图片.")
     return image_paths, image_prompt
 
-def generate_and_save_images(image_server, image_model, llm_server, llm_model, parsed_content, num_plots, num_images, size, saving_path):
+def generate_and_save_images(image_server, image_model, llm_server, llm_model, parsed_content, num_plots, num_images, size, saving_path, refresh_llm_cache=False):
     image_paths = []
     image_prompts = []
     
     if num_images > 0:
-        for i in range(num_plots):
-            plot_images, prompt = generate_images(image_server, image_model, llm_server, llm_model, 
-                                                  parsed_content, plot_index=i+1, size=size, num_images=num_images, saving_path=saving_path)
+        # Each plot is independent and I/O bound (LLM prompt + image API + download),
+        # so run plots concurrently and collect the results in plot order
+        def generate_plot(plot_index):
+            return generate_images(image_server, image_model, llm_server, llm_model, 
+                                   parsed_content, plot_index=plot_index, size=size, num_images=num_images, saving_path=saving_path,
+                                   refresh_llm_cache=refresh_llm_cache)
+
+        executor = ThreadPoolExecutor(max_workers=min(num_plots, MAX_IMAGE_WORKERS))
+        try:
+            futures = [executor.submit(generate_plot, plot_index) for plot_index in range(1, num_plots + 1)]
+            # Surface the first failure as soon as it happens, whichever plot it is
+            for future in as_completed(futures):
+                future.result()
+        finally:
+            # On failure, cancel the plots not yet started instead of paying for them
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in futures:
+            plot_images, prompt = future.result()
             image_paths.extend(plot_images)
             image_prompts.append(prompt)
         
@@ -263,55 +339,124 @@ def prepare_images_for_video(images_folder, num_plots, num_images):
     
     return selected_images
     
-def create_video(audio_path, image_path, output_path):
+def _ffmpeg_error(e):
+    # CalledProcessError only shows the exit code; ffmpeg's reason is in stderr
+    stderr = getattr(e, "stderr", None)
+    if stderr:
+        return f"{e}\n{stderr.decode('utf-8', errors='replace').strip()}"
+    return str(e)
+
+def _encode_still_video(audio_path, image_path, output_path):
+    # 单张静态图片 + 音频：让 ffmpeg 循环同一帧编码，跳过 MoviePy 的逐帧渲染
+    cmd = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-loop", "1", "-framerate", "24", "-i", image_path,
+        "-i", audio_path,
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",  # yuv420p 要求宽高为偶数
+        "-c:v", "libx264", "-tune", "stillimage", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest",
+        # -shortest alone lets the looped video overrun the audio by the mux buffer
+        "-fflags", "+shortest", "-max_interleave_delta", "0",
+        output_path
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return output_path
+
+def _concat_videos(video_paths, output_path):
+    # 各幕视频编码参数一致，用 concat demuxer 直接拷贝码流，无需解码再重新编码
+    list_path = os.path.splitext(output_path)[0] + "_concat.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in video_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        cmd = [
+            get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", output_path
+        ]
+        subprocess.run(cmd, check=True, capture_output=True)
+    finally:
+        os.remove(list_path)
+    return output_path
+
+def _create_video(audio_path, image_path, output_path):
+    # Returns (output_path or None, whether the direct ffmpeg encode was used)
+    try:
+        return _encode_still_video(audio_path, image_path, output_path), True
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"ffmpeg 直接编码失败，改用 MoviePy: {_ffmpeg_error(e)}")
+
     try:
         # Load audio and image
         audio = AudioFileClip(audio_path)
-        image = ImageClip(image_path).set_duration(audio.duration)
+        try:
+            image = ImageClip(image_path).set_duration(audio.duration)
 
-        # Create and save video
-        video = CompositeVideoClip([image]).set_audio(audio)
-        video.write_videofile(output_path, fps=24)
+            # Create and save video
+            video = image.set_audio(audio)
+            video.write_videofile(output_path, fps=24)
+        finally:
+            # 及时关闭音频读取进程，避免多幕累积占用 ffmpeg 进程和文件句柄
+            audio.close()
 
-        return output_path
+        return output_path, False
     
     except Exception as e:
         print(f"生成视频错误: {str(e)}")
-        return None
+        return None, False
+
+def create_video(audio_path, image_path, output_path):
+    return _create_video(audio_path, image_path, output_path)[0]
     
 def create_media(parsed_content, audio_paths, image_paths, video_paths, generate_video=False, server="openai", voice="alloy"):
 
     audio_files = []
     plot_videos = []
+    # Stream-copy concat is only safe when every plot shares the direct ffmpeg encode settings
+    all_direct_encoded = True
     
-    # Process each plot segment
-    for i, plot in enumerate(parsed_content['segmentations']):
-        # Generate audio for current plot
-        audio_file = text_to_audio(
-            server=server,
-            text=plot['plot'],
-            output_filename=os.path.join(audio_paths, f"plot_{i+1}.wav"),
-            voice=voice
-        )
-        print(f"已生成第 {i+1} 幕的音频。")
-        
-        if not audio_file:
-            print(f"第 {i+1} 幕的音频生成错误。")
-            continue
+    # Synthesize narration on a single background worker, in plot order, so the
+    # next plot's TTS request runs while the current plot's video is encoding
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        audio_futures = [
+            executor.submit(
+                text_to_audio,
+                server=server,
+                text=plot['plot'],
+                output_filename=os.path.join(audio_paths, f"plot_{i+1}.wav"),
+                voice=voice
+            )
+            for i, plot in enumerate(parsed_content['segmentations'])
+        ]
+
+        # Process each plot segment
+        for i, audio_future in enumerate(audio_futures):
+            audio_file = audio_future.result()
+            print(f"已生成第 {i+1} 幕的音频。")
             
-        audio_files.append(audio_file)
-        
-        # If video generation is requested, create video for current plot segment
-        if generate_video:
-            plot_image_paths = image_paths[i:i+1]  # One image per plot
-            plot_video_path = os.path.join(video_paths, f"plot_{i+1}.mp4")
-            plot_video_path = create_video(audio_file, plot_image_paths[0], plot_video_path)
+            if not audio_file:
+                print(f"第 {i+1} 幕的音频生成错误。")
+                continue
+                
+            audio_files.append(audio_file)
             
-            if plot_video_path:
-                plot_videos.append(plot_video_path)
-                print(f"第 {i+1} 幕的视频已生成: {plot_video_path}")
-            else:
-                print(f"第 {i+1} 幕的视频生成错误。")
+            # If video generation is requested, create video for current plot segment
+            if generate_video:
+                plot_image_paths = image_paths[i:i+1]  # One image per plot
+                plot_video_path = os.path.join(video_paths, f"plot_{i+1}.mp4")
+                plot_video_path, direct_encoded = _create_video(audio_file, plot_image_paths[0], plot_video_path)
+                
+                if plot_video_path:
+                    plot_videos.append(plot_video_path)
+                    all_direct_encoded = all_direct_encoded and direct_encoded
+                    print(f"第 {i+1} 幕的视频已生成: {plot_video_path}")
+                else:
+                    print(f"第 {i+1} 幕的视频生成错误。")
+    finally:
+        # On any error (incl. Ctrl-C) drop the queued TTS calls instead of waiting on them
+        executor.shutdown(wait=False, cancel_futures=True)
     
     # If no audio files were generated, return None
     if not audio_files:
@@ -330,9 +475,26 @@ def create_media(parsed_content, audio_paths, image_paths, video_paths, generate
         
     # Concatenate all plot videos into final video
     final_video_path = os.path.join(video_paths, "full_video.mp4")
-    clips = [VideoFileClip(video) for video in plot_videos]
-    final_video = concatenate_videoclips(clips)
-    final_video.write_videofile(final_video_path)
+    concatenated = False
+    if all_direct_encoded:
+        try:
+            _concat_videos(plot_videos, final_video_path)
+            concatenated = True
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"ffmpeg 直接拼接失败，改用 MoviePy: {_ffmpeg_error(e)}")
+    else:
+        print("部分视频由 MoviePy 生成，编码参数不一致，改用 MoviePy 重新编码拼接。")
+    
+    if not concatenated:
+        clips = [VideoFileClip(video) for video in plot_videos]
+        try:
+            # Direct encodes are rounded to even sizes and MoviePy's are not, so mixed sets need compose
+            final_video = concatenate_videoclips(clips, method="chain" if all_direct_encoded else "compose")
+            final_video.write_videofile(final_video_path)
+        finally:
+            # 释放每个片段的 ffmpeg 读取进程和文件句柄
+            for clip in clips:
+                clip.close()
     print(f"完成的视频已生成: {final_video_path}")
     
     return final_video_path
\ No newline at end of file
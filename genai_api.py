@@ -2,7 +2,9 @@ import os, requests
 import anthropic
 from openai import OpenAI
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 import azure.cognitiveservices.speech as speechsdk
 
 # Azure credentials and endpoints
@@ -17,10 +19,28 @@ AIPROXY_URL = os.getenv('AIPROXY_URL')
 if not all([AZURE_SPEECH_KEY, AZURE_SPEECH_REGION, SILICONFLOW_KEY, AIPROXY_API_KEY, AIPROXY_URL]):
     raise ValueError("Missing required Azure credentials in .env file.")
 
-def make_api_request(api_url, method, headers, payload=None):
+# Shared clients so API calls and image downloads reuse keep-alive connections.
+# http_session is shared by the image worker threads: it is only used for stateless
+# requests (headers passed per call, nothing stored on the session), never cookies or auth.
+http_session = requests.Session()
+# Retry's default allowed_methods leave POST out, so paid generation calls are never resent
+_http_adapter = HTTPAdapter(
+    pool_connections=8, pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+)
+http_session.mount("http://", _http_adapter)
+http_session.mount("https://", _http_adapter)
+
+# (connect, read) timeouts in seconds. Paid generation calls (LLM completions, image
+# generation) are synchronous and can take minutes, so they get a long read timeout
+HTTP_TIMEOUT = (5, 30)
+GENERATION_HTTP_TIMEOUT = (5, 300)
+openai_client = OpenAI(api_key=AIPROXY_API_KEY, base_url=AIPROXY_URL)
+
+def make_api_request(api_url, method, headers, payload=None, timeout=HTTP_TIMEOUT):
     try:
         # Make the API request using the requests library
-        response = requests.request(method, api_url, json=payload, headers=headers)
+        response = http_session.request(method, api_url, json=payload, headers=headers, timeout=timeout)
         response.raise_for_status()  # Raise an exception for HTTP errors
         return response.json() if response.content else {}
     except RequestException as e:
@@ -36,8 +56,7 @@ def text_to_text(server, model, prompt, system_message="", max_tokens=4000, temp
     
     # OpenAI Server
     if server == "openai":
-        client = OpenAI(api_key=AIPROXY_API_KEY, base_url=AIPROXY_URL)
-        response = client.chat.completions.create(
+        response = openai_client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -58,7 +77,7 @@ def text_to_text(server, model, prompt, system_message="", max_tokens=4000, temp
             "stream": False, "top_p": 0.7, "top_k": 50, "frequency_penalty": 0.5, "n": 1,
             "response_format": {"type": "json_object"}
         }
-        response = requests.post("https://api.siliconflow.cn/v1/chat/completions", headers=headers, json=payload).json()
+        response = http_session.post("https://api.siliconflow.cn/v1/chat/completions", headers=headers, json=payload, timeout=GENERATION_HTTP_TIMEOUT).json()
         
         if output_format == "text":
             response.get("choices", [{}])[0].get('message', {}).get('content')
@@ -72,8 +91,7 @@ def text_to_image(prompt, size, server="siliconflow", model="black-forest-labs/F
     
     # Create OpenAI client
     if server == "openai":
-        client = OpenAI(base_url=AIPROXY_URL, api_key=AIPROXY_API_KEY)
-        response = client.images.generate(
+        response = openai_client.images.generate(
             model=model, prompt=prompt, n=1, quality="hd", style="vivid", size=size
         )
         return response.data[0].url if response.data else None
@@ -82,7 +100,8 @@ def text_to_image(prompt, size, server="siliconflow", model="black-forest-labs/F
     elif server == "siliconflow":
         headers = {"Authorization": f"Bearer {SILICONFLOW_KEY}", "Content-Type": "application/json"}
         payload = {"model": model, "prompt": prompt, "image_size": size}
-        response = make_api_request("https://api.siliconflow.cn/v1/image/generations", "POST", headers, payload)
+        response = make_api_request("https://api.siliconflow.cn/v1/image/generations", "POST", headers, payload,
+                                    timeout=GENERATION_HTTP_TIMEOUT)
         return response.get("images", [{}])[0].get('url')
     
     else:
@@ -92,8 +111,7 @@ def text_to_audio(server, text, output_filename, voice):
     
     if server == "openai":
         try:
-            client = OpenAI(base_url=AIPROXY_URL, api_key=AIPROXY_API_KEY)
-            response = client.audio.speech.create(model="tts-1", voice=voice, input=text)
+            response = openai_client.audio.speech.create(model="tts-1", voice=voice, input=text)
 
             # Save the audio content to a file
             with open(output_filename, 'wb') as audio_file:
@@ -1,7 +1,7 @@
-from genai_api import text_to_image
+from genai_api import text_to_image, http_session, HTTP_TIMEOUT
 from datetime import datetime
 from pathlib import Path
-import os, requests
+import os
 
 def generate_and_save_images(prompt, num_images=1, size="1024x1024", server="siliconflow", model="black-forest-labs/FLUX.1-schnell"):
     """
@@ -39,7 +39,7 @@ def generate_and_save_images(prompt, num_images=1, size="1024x1024", server="sil
                 raise Exception(f"第{i+1}张图片生成失败")
             
             # 下载图片
-            response = requests.get(image_url)
+            response = http_session.get(image_url, timeout=HTTP_TIMEOUT)
             if response.status_code != 200:
                 raise Exception(f"第{i+1}张图片下载失败")
             
@@ -9,7 +9,7 @@ def main(content, num_plots=5,
          llm_server="siliconflow", llm_model="Qwen/Qwen2.5-72B-Instruct-128K", 
          image_server=None, image_model="black-forest-labs/FLUX.1-schnell", 
          tts_server=None, voice="alloy", 
-         generate_video=False, output_dir=None):
+         generate_video=False, output_dir=None, refresh_llm_cache=False):
     
     try:
         # Input validation
@@ -32,7 +32,7 @@ def main(content, num_plots=5,
         os.makedirs(visualization_folder, exist_ok=True)
         
         # Process content
-        parsed_content = content_parser(llm_server, llm_model, content, num_plots)
+        parsed_content = content_parser(llm_server, llm_model, content, num_plots, refresh=refresh_llm_cache)
         if not parsed_content:
             raise ValueError("无法解析内容。")
         parsed_saver(parsed_content, visualization_folder)
@@ -52,7 +52,8 @@ def main(content, num_plots=5,
             os.makedirs(images_folder, exist_ok=True)
             image_paths, prompt_file = generate_and_save_images(
                 image_server, image_model, llm_server, llm_model,
-                parsed_content, num_plots, num_images, image_size, images_folder
+                parsed_content, num_plots, num_images, image_size, images_folder,
+                refresh_llm_cache=refresh_llm_cache
             )
             result["images"] = image_paths
             result["image_prompts"] = prompt_file